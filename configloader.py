@@ -0,0 +1,17 @@
+import os
+from functools import lru_cache
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+@lru_cache(maxsize=16)
+def _load_toml_cached(path, mtime):
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def load_toml(path):
+    """Loads a TOML file, reusing the parsed result until the file is modified. Raises FileNotFoundError if missing.
+    Every caller gets the same dict, so treat it as read-only and copy it before making changes."""
+    path = os.path.abspath(path)
+    return _load_toml_cached(path, os.path.getmtime(path))
@@ -3,34 +3,36 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
 import os
 from getpass import getpass
 import csv
-import toml
+import html
+import queue
+import re
+import threading
+from configloader import load_toml
 
 my_username = os.getenv("CANVAS_USERNAME") or input("Enter Canvas username: ")
 my_password = os.getenv("CANVAS_PASSWORD") or getpass("Enter Canvas password: ")
 
 # Read config
-config = toml.load(os.path.join(os.path.dirname(__file__), "config.toml"))
+config = load_toml(os.path.join(os.path.dirname(__file__), "config.toml"))
 course_number = config.get("course_number")
 homework_title = config.get("homework_title")
 gradebook_path = config.get("gradebook")
 feedback_dir = os.path.join(config.get("homework_dir"), config.get("feedback_dir"))
 debug_mode = config.get("debug", False)
-headless_mode = config.get("headless", False)
+headless_mode = config.get("headless", True)
+# Number of browsers uploading feedback in parallel, each with its own Canvas login
+feedback_workers = config.get("feedback_workers", 1)
 
 # Extract assignment_id from gradebook header
+# Only the header line is needed, so read just that line and parse it
 with open(gradebook_path, newline='', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    header = next(reader)
-assignment_id = None
-import re
-for col in header:
-    m = re.match(rf"{re.escape(homework_title)} \((\d+)\)", col)
-    if m:
-        assignment_id = m.group(1)
-        break
+    header = next(csv.reader([f.readline()]))
+assignment_col = re.compile(rf"{re.escape(homework_title)} \((\d+)\)")
+assignment_id = next((m.group(1) for col in header if (m := assignment_col.match(col))), None)
 if not assignment_id:
     raise ValueError(f"Assignment ID not found for title '{homework_title}' in gradebook header.")
 
@@ -38,23 +40,27 @@ if not assignment_id:
 #     user_data_dir = "C:/Users/hxjz233/AppData/Local/Google/Chrome/User Data"  # e.g., "C:/Users/YourName/AppData/Local/Google/Chrome/User Data"
 # else:
 #     user_data_dir = os.path.expanduser("/mnt/c/Users/hxjz233/AppData/Local/Google/Chrome/User Data")
-if os.name == "nt":
-    user_data_dir = os.path.expanduser("~/AppData/Local/Google/Chrome/User Data")
-else:
-    user_data_dir = os.path.expanduser("~/.config/google-chrome")
+# The grader keeps its own Chrome profiles, so it neither collides with a running Chrome nor changes the user's browser settings
+profile_base_dir = os.path.expanduser("~/.cache/phys150grader")
+
+# Only one browser goes through the login (and Duo prompt) at a time
+login_lock = threading.Lock()
 
 
 def login_to_canvas(driver):
     # The driver will be navigated to the correct URL for each student later
-    WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.ID, "i0116"))
-    )
-    username = driver.find_element(By.ID, "i0116")
+    # WebDriverWait.until returns the element it waited for, so no separate find_element round trip is needed
+    try:
+        username = WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.ID, "i0116"))
+        )
+    except TimeoutException:
+        # No sign-in page: the saved Chrome profile is still logged in
+        return driver
     username.send_keys(my_username)
-    WebDriverWait(driver, 10).until(
+    next_bot = WebDriverWait(driver, 10).until(
         EC.element_to_be_clickable((By.ID, "idSIButton9"))
     )
-    next_bot = driver.find_element(By.ID, "idSIButton9")
     next_bot.click()
     WebDriverWait(driver, 10).until(
         EC.presence_of_element_located((By.ID, "idA_PWD_ForgotPassword"))
@@ -63,10 +69,9 @@ def login_to_canvas(driver):
     pwd.send_keys(my_password)
     next_bot = driver.find_element(By.ID, "idSIButton9")
     next_bot.click()
-    WebDriverWait(driver, 20).until(
+    next_bot = WebDriverWait(driver, 20).until(
         EC.element_to_be_clickable((By.ID, "trust-browser-button"))
     )
-    next_bot = driver.find_element(By.ID, "trust-browser-button")
     next_bot.click()
     WebDriverWait(driver, 10).until(
         EC.presence_of_element_located((By.ID, "KmsiCheckboxField"))
@@ -75,10 +80,22 @@ def login_to_canvas(driver):
     next_bot.click()
     return driver
 
+# Comments already posted to the current student in speed grader
+comment_selector = (By.CSS_SELECTOR, "#comments .comment")
+
+# Leading spaces and runs of spaces, which HTML would collapse into one
+space_run = re.compile(r"^ +| {2,}")
+
+def feedback_line_html(line):
+    """One feedback line as an editor paragraph, keeping its indentation the way typed spaces would be kept."""
+    text = html.escape(line.rstrip("\n")).replace("\t", " " * 4)
+    text = space_run.sub(lambda m: "&nbsp;" * len(m.group()), text)
+    return f"<p>{text or '<br>'}</p>"
+
 def upload_feedback(driver, feedback_path):
-    # Read feedback text from file
+    # Read feedback from file line by line, escaping it into editor paragraphs that preserve formatting
     with open(feedback_path, "r", encoding="utf-8") as f:
-        feedback_text = f.read()
+        feedback_html = "".join(feedback_line_html(line) for line in f)
         
     # Wait for student select menu to appear before continuing. This is the true indicator that the page has fully loaded.
     WebDriverWait(driver, 30).until(
@@ -87,76 +104,137 @@ def upload_feedback(driver, feedback_path):
 
     # Wait for iframe to be present and switch to it
     WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.CSS_SELECTOR, "iframe[id*='rce_textarea']"))
+        EC.frame_to_be_available_and_switch_to_it((By.CSS_SELECTOR, "iframe[id*='rce_textarea']"))
     )
-    iframe = driver.find_element(By.CSS_SELECTOR, "iframe[id*='rce_textarea']")
-    driver.switch_to.frame(iframe)
 
     # Wait for the contenteditable body to be present
-    WebDriverWait(driver, 10).until(
+    editor_body = WebDriverWait(driver, 10).until(
         EC.presence_of_element_located((By.CSS_SELECTOR, "body.mce-content-body[contenteditable='true']"))
     )
-    editor_body = driver.find_element(By.CSS_SELECTOR, "body.mce-content-body[contenteditable='true']")
-    driver.execute_script("arguments[0].focus();", editor_body)
-    # Send feedback text, preserving formatting
-    for line in feedback_text.splitlines():
-        editor_body.send_keys(line)
-        editor_body.send_keys("\n")
+    # Set the whole feedback in one script call instead of send_keys per line
+    driver.execute_script(
+        "arguments[0].focus(); arguments[0].innerHTML = arguments[1]; arguments[0].dispatchEvent(new Event('input', {bubbles: true}));",
+        editor_body, feedback_html
+    )
 
     # Switch back to main content before submitting
     driver.switch_to.default_content()
     # Wait for submit button to be present
-    WebDriverWait(driver, 10).until(
+    submit = WebDriverWait(driver, 10).until(
         EC.presence_of_element_located((By.ID, "comment_submit_button"))
     )
-    submit = driver.find_element(By.ID, "comment_submit_button")
     
     if not debug_mode:
+        # The comment is saved once it shows up in the student's comment list
+        comments_before = len(driver.find_elements(*comment_selector))
         driver.execute_script("arguments[0].click();", submit)
+        WebDriverWait(driver, 30).until(lambda d: len(d.find_elements(*comment_selector)) > comments_before)
         print(f'Submitted {feedback_path}.')
     else:
         print(f'DEBUG MODE: Would have submitted {feedback_path}.')
 
-    WebDriverWait(driver, 1)
 
+# Only the student id changes between speed grader urls
+speed_grader_base_url = f"https://canvas.tamu.edu/courses/{course_number}/gradebook/speed_grader?assignment_id={assignment_id}&student_id="
 
-if __name__ == "__main__":
+def speed_grader_url(student_id):
+    return speed_grader_base_url + student_id
+
+def setup_driver(worker_idx):
     chrome_options = Options()
     if headless_mode:
-        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--remote-debugging-port=9222")
+    # Only the DOM is needed, so skip images and background features to speed up each page load
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-background-networking")
+    chrome_options.add_argument("--disable-sync")
+    chrome_options.add_argument("--disable-translate")
+    chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    # Each browser needs its own debugging port
+    chrome_options.add_argument(f"--remote-debugging-port={9222 + worker_idx}")
+    # Keep the login session between runs; Chrome locks a profile, so each worker gets its own
+    profile_dir = os.path.join(profile_base_dir, f"chrome-profile-{worker_idx}")
+    chrome_options.add_argument(f"--user-data-dir={profile_dir}")
+    chrome_options.add_argument("--profile-directory=Default")
+    return webdriver.Chrome(options=chrome_options)
+
+def next_job(jobs):
+    try:
+        return jobs.get_nowait()
+    except queue.Empty:
+        return None
+
+def upload_worker(worker_idx, jobs, failed):
+    """Uploads (student_id, feedback_path) jobs from the queue in one browser, logging in on its first student.
+    The next student's page is opened in a second tab so it loads while the current feedback is entered.
+    Students whose upload fails are added to failed."""
+    driver = None
+    try:
+        job = next_job(jobs)
+        while job is not None:
+            student_id, feedback_path = job
+            following_job = None
+            try:
+                if driver is None:
+                    canvas_url = speed_grader_url(student_id)
+                    print(f"Navigating to {canvas_url}")
+                    driver = setup_driver(worker_idx)
+                    driver.get(canvas_url)
+                    with login_lock:
+                        driver = login_to_canvas(driver)
+                following_job = next_job(jobs)
+                if following_job is not None:
+                    canvas_url = speed_grader_url(following_job[0])
+                    print(f"Navigating to {canvas_url}")
+                    # window.open returns right away, unlike driver.get which waits for the page to load
+                    driver.execute_script("window.open(arguments[0], '_blank');", canvas_url)
+                upload_feedback(driver, feedback_path)
+                if following_job is not None:
+                    # Done with this student: once the comment form is idle again, close the tab and continue in the one that has been loading meanwhile
+                    WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.ID, "comment_submit_button")))
+                    driver.close()
+                    driver.switch_to.window(driver.window_handles[-1])
+            except Exception as e:
+                print(f"Failed to upload feedback for {student_id}: {e}")
+                failed.append(student_id)
+                # The prefetched student was never started, so hand it back
+                if following_job is not None:
+                    jobs.put(following_job)
+                    following_job = None
+                # The browser may be left on any page or tab; start over with a fresh one for the next student
+                if driver is not None:
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+                    driver = None
+            job = following_job if following_job is not None else next_job(jobs)
+    finally:
+        if driver is not None:
+            driver.quit()  # Close browser when done
 
-    driver = webdriver.Chrome(options=chrome_options)
 
-    # Filter for .txt files and sort them once
-    feedback_files = sorted([f for f in os.listdir(feedback_dir) if f.endswith('.txt')])
+if __name__ == "__main__":
+    # Filter for .txt files and sort them once; scandir entries know their type without an extra stat
+    feedback_files = sorted(e.name for e in os.scandir(feedback_dir) if e.is_file() and e.name.endswith('.txt'))
 
     if not feedback_files:
         print(f"No .txt files found in {feedback_dir}")
     else:
-        # Login once before processing all students
-        first_file = feedback_files[0]
-        first_student_id = os.path.splitext(first_file)[0]
-        login_url = f"https://canvas.tamu.edu/courses/{course_number}/gradebook/speed_grader?assignment_id={assignment_id}&student_id={first_student_id}"
-        print(f"Navigating to initial page for login: {login_url}")
-        driver.get(login_url)
-        driver = login_to_canvas(driver)
-        
-        # Now process the first student's feedback since we are already on their page
-        print(f"Uploading feedback for first student: {first_student_id}")
-        first_feedback_path = os.path.join(feedback_dir, first_file)
-        upload_feedback(driver, first_feedback_path)
-
-        # Process the rest of the students
-        for fname in feedback_files[1:]:
-            student_id = os.path.splitext(fname)[0]
-            feedback_path = os.path.join(feedback_dir, fname)
-            canvas_url = f"https://canvas.tamu.edu/courses/{course_number}/gradebook/speed_grader?assignment_id={assignment_id}&student_id={student_id}"
-            print(f"Navigating to {canvas_url}")
-            driver.get(canvas_url)
-            upload_feedback(driver, feedback_path)
-
-    driver.quit()  # Close browser when done
+        jobs = queue.Queue()
+        feedback_prefix = os.path.join(feedback_dir, "")
+        for fname in feedback_files:
+            jobs.put((fname[:-len('.txt')], feedback_prefix + fname))
+        # Students are independent, so several browsers can work through the queue at once
+        failed = []
+        workers = [threading.Thread(target=upload_worker, args=(i, jobs, failed)) for i in range(max(1, min(feedback_workers, len(feedback_files))))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if failed:
+            print(f"Feedback upload failed for {len(failed)} student(s): {', '.join(sorted(failed))}")
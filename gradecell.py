@@ -1,50 +1,121 @@
 import nbformat
-import toml
 import sys
 import os
-import io
-from contextlib import redirect_stdout
-from types import SimpleNamespace
+import re
+import copy
+import hashlib
 import platform
+from functools import lru_cache
+from itertools import islice
+from string import Formatter
+
+# Student cells that plot get the non-interactive backend, set once per process before matplotlib is imported
+os.environ.setdefault("MPLBACKEND", "Agg")
 
 # Import run_cell and is_code_safe depending on OS
 if platform.system() == "Linux" or platform.system() == "Darwin":
     from safecode_unix import run_cell
 else:
     from safecode import run_cell
-from safecode import is_code_safe, remove_input_lines, sanitize_student_code
+from safecode import is_code_safe, remove_input_lines, sanitize_student_code, CellStatus
+from configloader import load_toml
 
 # Load tester.toml from homework directory if specified
 def get_tester_toml():
     config_path = os.path.join(os.path.dirname(__file__), "config.toml")
-    if os.path.exists(config_path):
-        config = toml.load(config_path)
-        homework_dir = config.get("homework_dir", None)
-        if homework_dir:
-            tester_path = os.path.join(homework_dir, "tester.toml")
-            if os.path.exists(tester_path):
-                return toml.load(tester_path)
+    try:
+        config = load_toml(config_path)
+    except FileNotFoundError:
+        config = {}
+    homework_dir = config.get("homework_dir", None)
+    if homework_dir:
+        tester_path = os.path.join(homework_dir, "tester.toml")
+        try:
+            return load_toml(tester_path)
+        except FileNotFoundError:
+            pass
     # fallback to local
-    return toml.load("tester.toml")
+    return load_toml("tester.toml")
+
+def _normalize(s):
+    # Remove leading/trailing whitespace, collapse all whitespace (including newlines) to single space
+    # str.split() with no argument splits on the same characters as \s, without going through the regex engine
+    return ' '.join(s.split())
 
-tester = get_tester_toml()
+# parse() keeps no state, so one Formatter serves every format string
+_FMT = Formatter()
+
+@lru_cache(maxsize=None)
+def _compile_format_regex(fmt, case_sensitive):
+    """Builds the regex for an output `format` once per (format, case sensitivity) pair."""
+    # Build the regex in one pass over the format's tokens: escaped literal text, and a named group for each {var}
+    parts = []
+    seen = set()
+    for literal, var, _, _ in _FMT.parse(fmt):
+        parts.append(re.escape(literal))
+        if var:
+            # A repeated {var} must match the same text again
+            parts.append(r'(?P=' + var + r')' if var in seen else r'(?P<' + var + r'>.+)')
+            seen.add(var)
+    regex = ''.join(parts) + r'\s*$'  # Allow trailing whitespace/newline at end
+    flags = re.DOTALL if case_sensitive else (re.DOTALL | re.IGNORECASE)
+    return re.compile(regex, flags)
 
 def _to_complex_if_needed(val):
     """Converts a dict with 'real' and 'imag' keys to a complex number."""
-    if isinstance(val, dict) and 'real' in val and 'imag' in val:
+    if type(val) is dict and 'real' in val and 'imag' in val:
         return complex(val['real'], val['imag'])
     return val
 
+def _normalize_expected(expected):
+    return _normalize(expected) if isinstance(expected, str) else expected
+
+def _lower_expected(expected):
+    return expected.lower() if isinstance(expected, str) else expected
+
+def _prepare_tester(tester):
+    """Pre-converts each test's input variables and expected values once, instead of once per student.
+    Returns a prepared copy, since the loaded tester dict is shared through load_toml's cache."""
+    tester = copy.deepcopy(tester)
+    for problem in tester.get("problem", []):
+        for test in problem.get("tests", []):
+            # Lists are kept as tuples so every test run gets its own fresh list
+            test["_vars_template"] = {
+                var: tuple(val) if isinstance(val, list) else _to_complex_if_needed(val)
+                for var, val in test.get("variables", {}).items()
+            }
+            # Variable tests compare against converted expected values, so convert them only once
+            if test.get("type") == "variable":
+                test["_expected_vars"] = {var: _to_complex_if_needed(expected) for var, expected in test["expected"].items()}
+            # Plain output tests compare against the normalized expected text, so normalize it only once
+            if test.get("type") == "output" and "format" not in test:
+                expected = test.get("expected")
+                if isinstance(expected, list):
+                    test["_expected_norm"] = [_normalize_expected(exp) for exp in expected]
+                    test["_expected_norm_lower"] = [_lower_expected(exp) for exp in test["_expected_norm"]]
+                else:
+                    test["_expected_norm"] = _normalize_expected(expected)
+                    test["_expected_norm_lower"] = _lower_expected(test["_expected_norm"])
+    return tester
+
+tester = _prepare_tester(get_tester_toml())
+# Every notebook must have exactly this many code cells
+_EXPECTED_CODE_CELLS = sum(p.get('next_code_cell', 0) for p in tester['problem'])
+# Total points available, the same for every notebook
+MAX_SCORE = sum(p.get("pts", 1) for p in tester["problem"])
+
+# Types that can be compared with a tolerance
+_NUMERIC = (int, float, complex)
+
 def check_test(test, test_ns, cell_output):
     if test["type"] == "variable":
         tol = test.get("tol", None)
-        for var, expected in test["expected"].items():
-            expected = _to_complex_if_needed(expected)  # Convert expected value
-            actual = test_ns.__dict__.get(var, None)
+        for var, expected in test["_expected_vars"].items():
+            actual = test_ns.get(var, None)
             if tol is not None:
                 # Try to compare as floats/complex with tolerance
                 try:
-                    if isinstance(actual, (int, float, complex)) and isinstance(expected, (int, float, complex)):
+                    if isinstance(actual, _NUMERIC) and isinstance(expected, _NUMERIC):
                         assert abs(actual - expected) <= tol, f"test for {var} expected {expected} (tol={tol}), got {actual}"
                     else:
                         raise AssertionError(f"test for {var} expected {expected}, got {actual} (non-numeric, cannot use tol)")
@@ -53,34 +124,21 @@ def check_test(test, test_ns, cell_output):
             else:
                 assert actual == expected, f"test for {var} expected {expected}, got {actual}"
     elif test["type"] == "output":
-        import re
-        from string import Formatter
-        def normalize(s):
-            # Remove leading/trailing whitespace, collapse all whitespace (including newlines) to single space
-            return re.sub(r'\s+', ' ', s.strip())
-
         # Use printed outputs if available (excludes input prompts), otherwise fall back to full cell_output
-        if hasattr(test_ns, 'printed_outputs') and test_ns.printed_outputs:
+        printed_outputs = test_ns.get('printed_outputs')
+        if printed_outputs:
             # Join all printed outputs with newlines to reconstruct the output stream
-            test_output = '\n'.join(test_ns.printed_outputs)
+            test_output = '\n'.join(printed_outputs)
         else:
             test_output = cell_output
 
         case_sensitive = test.get("case_sensitive", False)
-        re_flags = re.DOTALL if case_sensitive else (re.DOTALL | re.IGNORECASE)
 
         if "format" in test:
             fmt = test["format"]
             expected_vars = test.get("expected", {})
             tol = test.get("tol", None)
-            # Build regex from format string
-            regex = re.escape(fmt)
-            # Replace {var} with regex group
-            for _, var, _, _ in Formatter().parse(fmt):
-                if var:
-                    regex = regex.replace(r'\{' + var + r'\}', r'(?P<' + var + r'>.+)')
-            regex = regex + r'\s*$'  # Allow trailing whitespace/newline at end
-            match = re.match(regex, normalize(test_output), flags=re_flags)
+            match = _compile_format_regex(fmt, case_sensitive).match(_normalize(test_output))
             if not match:
                 cs_hint = "(case-sensitive)" if case_sensitive else "(case-insensitive)"
                 raise AssertionError(f"Output did not match expected format.\nExpected format {cs_hint}: {fmt}\nActual: {test_output}")
@@ -101,41 +159,88 @@ def check_test(test, test_ns, cell_output):
                     # Fallback to string comparison
                     assert str(actual_val) == str(expected_val), f"{var}: expected '{expected_val}', got '{actual_val}'"
         elif isinstance(test["expected"], list):
-            for expected, actual in zip(test["expected"], test_output if isinstance(test_output, list) else [test_output]):
+            expected_norms = test["_expected_norm"] if case_sensitive else test["_expected_norm_lower"]
+            for expected, expected_norm, actual in zip(test["expected"], expected_norms, test_output if isinstance(test_output, list) else [test_output]):
                 if case_sensitive:
-                    assert normalize(actual) == normalize(expected), f"test for output expected {expected}, got {actual} (case-sensitive)"
+                    assert _normalize(actual) == expected_norm, f"test for output expected {expected}, got {actual} (case-sensitive)"
                 else:
-                    assert normalize(actual).lower() == normalize(expected).lower(), f"test for output expected {expected}, got {actual} (case-insensitive)"
+                    assert _normalize(actual).lower() == expected_norm, f"test for output expected {expected}, got {actual} (case-insensitive)"
         else:
             if case_sensitive:
-                assert normalize(test_output) == normalize(test["expected"]), f"test for output expected {test['expected']}, got {test_output} (case-sensitive)"
+                assert _normalize(test_output) == test["_expected_norm"], f"test for output expected {test['expected']}, got {test_output} (case-sensitive)"
             else:
-                assert normalize(test_output).lower() == normalize(test["expected"]).lower(), f"test for output expected {test['expected']}, got {test_output} (case-insensitive)"
+                assert _normalize(test_output).lower() == test["_expected_norm_lower"], f"test for output expected {test['expected']}, got {test_output} (case-insensitive)"
     else:
         raise ValueError("Unknown test type")
 
+def _code_cells(nb):
+    """Collects a notebook's code cells in order, so they can be indexed directly."""
+    return [cell for cell in nb.cells if cell.cell_type == "code"]
+
 def get_code_cell_by_accumulated_index(nb, target_index):
-    count = 0
-    for cell in nb.cells:
-        if cell.cell_type == "code":
-            count += 1
-            if count == target_index:
-                return cell
-    raise IndexError(f"Code cell number {target_index} not found.")
+    return _code_cell_at(_code_cells(nb), target_index)
+
+def _code_cell_at(code_cells, target_index):
+    """Returns the 1-based `target_index`-th cell of a pre-collected list of code cells."""
+    if not 1 <= target_index <= len(code_cells):
+        raise IndexError(f"Code cell number {target_index} not found.")
+    return code_cells[target_index - 1]
+
+def _describe_inputs(test):
+    """Formats a test's inputs for failure messages; only called when a test does not pass."""
+    formatted_inputs = []
+    for k, v in test.get("variables", {}).items():
+        converted_v = _to_complex_if_needed(v)
+        formatted_inputs.append(f'{k}={converted_v}')
+    input_str = ', '.join(formatted_inputs)
+
+    input_overload_val = test.get("input_overload", None)
+    if input_overload_val is not None:
+        if input_str:
+            input_str += f", all inputs be {repr(input_overload_val)}"
+        else:
+            input_str = f"all inputs be {repr(input_overload_val)}"
+    return input_str
+
+def _prepare_student_code(student_code, strip_inputs):
+    """Drops input() lines if requested and sanitizes the student's (already offset) cell code."""
+    if strip_inputs:
+        student_code = remove_input_lines(student_code)
+    # Sanitize student code to remove disruptive calls
+    return sanitize_student_code(student_code)
+
+def _code_fingerprint(code_cells):
+    """Hashes the sources of a notebook's code cells; notebooks with the same code get the same grade."""
+    h = hashlib.blake2b(digest_size=16)
+    for cell in code_cells:
+        source = cell.source if isinstance(cell.source, str) else "".join(cell.source)
+        h.update(source.encode("utf-8", "surrogatepass"))
+        h.update(b"\0")  # Keep cell boundaries in the hash
+    return h.digest()
+
+# Results already computed in this process, keyed by _code_fingerprint, so identical submissions are graded once
+_graded_cache = {}
 
 def grade_notebook(nb=None):
     if nb is None:
         # This case is for when grade_notebook is called to get max_score without a notebook
-        max_score = sum(p.get("pts", 1) for p in tester["problem"])
-        return None, None, max_score, None
+        return None, None, MAX_SCORE, None
+
+    # Collect code cells once; used for both the count check and per-problem lookup
+    code_cells = _code_cells(nb)
 
     # --- Cell count check ---
-    expected_code_cells = sum(p.get('next_code_cell', 0) for p in tester['problem'])
-    actual_code_cells = sum(1 for cell in nb.cells if cell.cell_type == 'code')
+    expected_code_cells = _EXPECTED_CODE_CELLS
+    actual_code_cells = len(code_cells)
     if actual_code_cells != expected_code_cells:
         test_results = {"expected": expected_code_cells, "got": actual_code_cells}
         return "CELL_MISMATCH", None, None, test_results
 
+    fingerprint = _code_fingerprint(code_cells)
+    cached = _graded_cache.get(fingerprint)
+    if cached is not None:
+        return cached
+
     results = []
     total_score = 0
     max_score = 0
@@ -146,133 +251,112 @@ def grade_notebook(nb=None):
         pts = problem.get("pts", 1)
         tests = problem["tests"]
         line_offset = problem.get("line_offset", 0)
-        cell = get_code_cell_by_accumulated_index(nb, current_code_cell_index)
+        cell = _code_cell_at(code_cells, current_code_cell_index)
+        # Remove all blank lines first, then only keep code after line_offset; this is the same for every test
+        cell_lines = cell.source.splitlines() if isinstance(cell.source, str) else cell.source
+        non_blank_lines = (line for line in cell_lines if line.strip())
+        student_code = "\n".join(islice(non_blank_lines, line_offset, None))
+        # (prepared code, safe, reason) keyed by whether input lines are stripped, shared by the tests of this problem
+        student_variants = {}
         passed = 0
         failed_tests = []
         safety_violation_count = 0
         timeout_violation_count = 0
         for test_idx, test in enumerate(tests, 1):
-            test_ns = SimpleNamespace()
+            key = f"prob{prob_idx}_test{test_idx}"
             test_inputs = test.get("variables", {})
-            for var, val in test_inputs.items():
-                val = _to_complex_if_needed(val)  # Convert input variable
-                setattr(test_ns, var, val)
+            input_overload_val = test.get("input_overload", None)
+
+            # If test has inputs OR we are overloading input, we shouldn't be using student's input() calls
+            # But if we are overloading, we need the line with input() to be there.
+            strip_inputs = bool(test_inputs) and input_overload_val is None
+
+            student_variant = student_variants.get(strip_inputs)
+            if student_variant is None:
+                student_body = _prepare_student_code(student_code, strip_inputs)
+                # Check code safety before running; prefix_code comes from tester.toml and is trusted
+                student_variant = (student_body, *is_code_safe(student_body))
+                student_variants[strip_inputs] = student_variant
+            student_body, safe, reason = student_variant
+            # Blocked tests never run, so skip building their namespace and spies
+            if not safe:
+                failed_tests.append(f"Test {test_idx} blocked on input ({_describe_inputs(test)}): {reason}")
+                safety_violation_count += 1
+                test_results[key] = (0, f"Blocked: {reason}")
+                continue
+
+            # The cell runs directly in this dict as its globals
+            test_ns = {var: list(val) if isinstance(val, tuple) else val for var, val in test["_vars_template"].items()}
 
             # --- Spy and Mock Implementation ---
-            test_ns.prompts_used = []
-            test_ns.printed_outputs = []
+            prompts_used = test_ns["prompts_used"] = []
+            printed_outputs = test_ns["printed_outputs"] = []
             original_print = print # Keep a reference to the real print
 
-            def spy_print(*args, **kwargs):
+            def spy_print(*args, sep=" ", end="\n", file=None, flush=False):
                 """Captures print arguments and also prints to stdout."""
-                # Reconstruct the message as a single string
-                output = io.StringIO()
-                kwargs['file'] = output
-                original_print(*args, **kwargs)
-                message = output.getvalue()
+                # Reconstruct the message as a single string, the same way print() would
+                message = (" " if sep is None else sep).join(map(str, args)) + ("\n" if end is None else end)
                 # Remove trailing newline that print adds, to match user expectation
                 if message.endswith('\n'):
                     message = message[:-1]
-                test_ns.printed_outputs.append(message)
-                # Also call original print to ensure it's captured by redirect_stdout
-                original_print(*args)
+                printed_outputs.append(message)
+                # Also call original print to ensure it's captured by run_cell
+                original_print(message)
 
 
-            input_overload_val = test.get("input_overload", None)
             if input_overload_val is not None:
                 if isinstance(input_overload_val, list):
                     inputs_iterator = iter(input_overload_val)
                     def spy_input_from_list(prompt=""):
-                        test_ns.prompts_used.append(prompt)
+                        prompts_used.append(prompt)
                         original_print(prompt, end="") # So it appears in cell_output
                         try:
                             return next(inputs_iterator)
                         except StopIteration:
                             return ""
-                    test_ns.input = spy_input_from_list
+                    test_ns["input"] = spy_input_from_list
                 else:
                     def spy_input_single(prompt=""):
-                        test_ns.prompts_used.append(prompt)
+                        prompts_used.append(prompt)
                         original_print(prompt, end="") # So it appears in cell_output
                         return input_overload_val
-                    test_ns.input = spy_input_single
+                    test_ns["input"] = spy_input_single
             
-            test_ns.print = spy_print
+            test_ns["print"] = spy_print
             # ------------------------------------
 
-            key = f"prob{prob_idx}_test{test_idx}"
             if cell.cell_type == "code":
-                # Remove all blank lines first
-                cell_lines = cell.source.splitlines() if isinstance(cell.source, str) else cell.source
-                non_blank_lines = [line for line in cell_lines if line.strip() != ""]
-                # Only execute code after line_offset
-                code_to_run = "\n".join(non_blank_lines[line_offset:])
-
                 # Add prefix code if specified (test-level takes precedence over problem-level)
                 prefix_lines = []
                 if "prefix_code" in test:
                     prefix_lines = test["prefix_code"]
                 elif "prefix_code" in problem:
                     prefix_lines = problem["prefix_code"]
-                
-                if prefix_lines:
-                    if isinstance(prefix_lines, str):
-                        prefix_lines = [prefix_lines]  # Convert single string to list
-                    prefix_code = "\n".join(prefix_lines)
-                    code_to_run = prefix_code + "\n" + code_to_run
-
-                # If test has inputs OR we are overloading input, we shouldn't be using student's input() calls
-                # But if we are overloading, we need the line with input() to be there.
-                if test_inputs and input_overload_val is None:
-                    code_to_run = remove_input_lines(code_to_run)
-
-                # Sanitize student code to remove disruptive calls
-                code_to_run = sanitize_student_code(code_to_run)
-
-                # Check code safety before running
-                safe, reason = is_code_safe(code_to_run)
-
-                # --- Build input_str with proper complex formatting ---
-                formatted_inputs = []
-                for k, v in test_inputs.items():
-                    converted_v = _to_complex_if_needed(v)
-                    formatted_inputs.append(f'{k}={converted_v}')
-                input_str = ', '.join(formatted_inputs)
-                # ----------------------------------------------------
-
-                if input_overload_val is not None:
-                    if input_str:
-                        input_str += f", all inputs be {repr(input_overload_val)}"
-                    else:
-                        input_str = f"all inputs be {repr(input_overload_val)}"
+                if prefix_lines and isinstance(prefix_lines, str):
+                    prefix_lines = [prefix_lines]  # Convert single string to list
+                code_to_run = "\n".join(prefix_lines) + "\n" + student_body if prefix_lines else student_body
 
-                if not safe:
-                    failed_tests.append(f"Test {test_idx} blocked on input ({input_str}): {reason}")
-                    safety_violation_count += 1
-                    test_results[key] = (0, f"Blocked: {reason}")
+                # run_cell compiles each distinct source once, captures the cell's stdout, and reports timeouts/errors in its result
+                cell_result = run_cell(code_to_run, test_ns)
+                if cell_result.status == CellStatus.TIMEOUT:
+                    failed_tests.append(f"Test {test_idx} timeout on input ({_describe_inputs(test)})")
+                    timeout_violation_count += 1
+                    test_results[key] = (0, "Timeout")
                     continue
-                f = io.StringIO()
-                try:
-                    with redirect_stdout(f):
-                        cell_result = run_cell(code_to_run, test_ns)
-                    if cell_result == "__DEADLOOP__":
-                        failed_tests.append(f"Test {test_idx} timeout on input ({input_str})")
-                        timeout_violation_count += 1
-                        test_results[key] = (0, "Timeout")
-                        continue
-                    cell_output = f.getvalue()
-                except Exception as exec_err:
+                if cell_result.status == CellStatus.ERROR:
+                    exec_err = cell_result.exc
                     err_type = type(exec_err).__name__
-                    failmsg = f"Test {test_idx} error ({err_type}) on input ({input_str}): {exec_err}"
+                    failmsg = f"Test {test_idx} error ({err_type}) on input ({_describe_inputs(test)}): {exec_err}"
                     failed_tests.append(failmsg)
                     test_results[key] = (0, failmsg)
                     continue
                 try:
-                    check_test(test, test_ns, cell_output)
+                    check_test(test, test_ns, cell_result.stdout)
                     passed += 1
                     test_results[key] = (1, "")
                 except AssertionError as e:
-                    failmsg = f"Test {test_idx} failed on input ({input_str}): {e}"
+                    failmsg = f"Test {test_idx} failed on input ({_describe_inputs(test)}): {e}"
                     failed_tests.append(failmsg)
                     test_results[key] = (0, failmsg)
         percent = passed / len(tests) if tests else 0
@@ -289,6 +373,9 @@ def grade_notebook(nb=None):
             "safety_violations": safety_violation_count,
             "timeout_violations": timeout_violation_count
         })
+    # A timeout depends on how busy the machine was, so an identical submission later gets a fresh run
+    if not any(res["timeout_violations"] for res in results):
+        _graded_cache[fingerprint] = (results, total_score, max_score, test_results)
     return results, total_score, max_score, test_results
 
 if __name__ == "__main__":
@@ -1,9 +1,29 @@
 import csv
+import hashlib
+import json
 import os
+import pickle
+import re
+import sys
+import tempfile
 import nbformat
 import importlib.util
 from collections import defaultdict
-import toml
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from configloader import load_toml
+# orjson decodes notebooks faster when installed; the stdlib json module works the same otherwise
+try:
+	import orjson
+except ImportError:
+	json_loads = json.loads
+else:
+	def json_loads(data):
+		# orjson is stricter than json (no NaN/Infinity, no integers beyond 64 bits), so fall back to json for those notebooks
+		try:
+			return orjson.loads(data)
+		except orjson.JSONDecodeError:
+			return json.loads(data)
 
 # Dynamically import gradecell.py
 spec = importlib.util.spec_from_file_location("gradecell", os.path.join(os.path.dirname(__file__), "gradecell.py"))
@@ -11,13 +31,20 @@ gradecell = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(gradecell)
 
 # Read config
-config = toml.load(os.path.join(os.path.dirname(__file__), "config.toml"))
+config = load_toml(os.path.join(os.path.dirname(__file__), "config.toml"))
 HOMEWORK_DIR = config.get("homework_dir", None)
 SUBMISSIONS_DIR = os.path.join(HOMEWORK_DIR, config.get("submissions_dir", "submissions"))
 
 GRADEBOOK = config.get("gradebook", "grade.csv")
 SUMMARY_DIR = HOMEWORK_DIR
 FEEDBACK_DIR = os.path.join(HOMEWORK_DIR, config.get("feedback_dir", "feedback"))
+# Number of processes grading notebooks in parallel; 1 grades in this process
+WORKERS = config.get("workers", os.cpu_count() or 1)
+# Per-student results from earlier runs, reused while the notebook and grading setup are unchanged
+CACHE_DIR = os.path.join(HOMEWORK_DIR, ".grade_cache")
+
+# Pulls the exception type out of "Test N error (Type) ..." failure messages; the group is empty if unclosed
+_ERR_TYPE_RE = re.compile(r'error \((?:([^)]+)\))?')
 
 # Explicitly define the first 4 column headers
 HEADERS = ["Student", "ID", "SIS Login ID", "Section"]
@@ -32,46 +59,171 @@ def get_userids_from_csv(csv_path):
 				userids.append(id_val.strip())
 	return userids
 
-def grade_notebook_for_user(userid):
-	nb_path = os.path.join(SUBMISSIONS_DIR, f"{userid}.ipynb")
-	print(f"Grading notebook for user {userid} at {nb_path}")
-	if not os.path.exists(nb_path):
+def get_submitted_notebooks():
+	"""Maps user IDs to notebook paths with a single scan of SUBMISSIONS_DIR."""
+	try:
+		with os.scandir(SUBMISSIONS_DIR) as entries:
+			return {entry.name[:-len(".ipynb")]: entry.path for entry in entries if entry.name.endswith(".ipynb") and entry.is_file()}
+	except FileNotFoundError:
+		return {}
+
+def _grading_setup_digest():
+	"""Hashes everything besides the notebook that affects a grade: the config, tester.toml and the code that reads and grades notebooks."""
+	here = os.path.dirname(os.path.abspath(__file__))
+	tester_path = os.path.join(HOMEWORK_DIR, "tester.toml")
+	if not os.path.isfile(tester_path):
+		tester_path = "tester.toml"
+	h = hashlib.sha256()
+	code_files = ("grader.py", "configloader.py", "gradecell.py", "safecode.py", "safecode_unix.py")
+	for path in (os.path.join(here, "config.toml"), tester_path, *(os.path.join(here, name) for name in code_files)):
+		try:
+			with open(path, "rb") as f:
+				h.update(f.read())
+		except FileNotFoundError:
+			pass
+		h.update(b"\0")
+	return h.hexdigest()
+
+GRADING_SETUP_DIGEST = _grading_setup_digest()
+
+def load_cached_grade(userid, digest):
+	"""Returns the cached grading result for userid if it was made from a notebook with this digest, else None."""
+	try:
+		with open(os.path.join(CACHE_DIR, f"{userid}.pkl"), "rb") as f:
+			cached = pickle.load(f)
+	except Exception:
+		return None
+	if cached.get("digest") != digest:
+		return None
+	return cached["result"]
+
+def save_cached_grade(userid, digest, result):
+	# Write to a temporary file and rename it, so an interrupted run never leaves a partial cache file
+	os.makedirs(CACHE_DIR, exist_ok=True)
+	fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			pickle.dump({"digest": digest, "result": result}, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.chmod(tmp_path, 0o600)
+		os.replace(tmp_path, os.path.join(CACHE_DIR, f"{userid}.pkl"))
+	except Exception:
+		os.remove(tmp_path)
+		raise
+
+def read_notebook(nb_path, data):
+	"""Reads a notebook for grading from its file contents, skipping nbformat's schema validation for v4 notebooks."""
+	raw = json_loads(data)
+	if raw.get("nbformat") != 4:
+		# Older formats still go through nbformat's conversion to v4
+		return nbformat.read(nb_path, as_version=4)
+	nb = nbformat.from_dict(raw)
+	# On disk, sources are usually split into lines; join them the way nbformat.read does
+	for cell in nb.cells:
+		if isinstance(cell.source, list):
+			cell.source = "".join(cell.source)
+	return nb
+
+def grade_notebook_for_user(userid, nb_path):
+	if nb_path is None:
+		print(f"No notebook found for user {userid} in {SUBMISSIONS_DIR}")
 		return None, None, None, None
-	nb = nbformat.read(open(nb_path, encoding="utf-8"), as_version=4)
+	with open(nb_path, "rb") as f:
+		data = f.read()
+	digest = hashlib.sha256(data).hexdigest() + GRADING_SETUP_DIGEST
+	cached = load_cached_grade(userid, digest)
+	if cached is not None:
+		print(f"Using cached grade for user {userid} at {nb_path}")
+		return cached
+	print(f"Grading notebook for user {userid} at {nb_path}")
+	nb = read_notebook(nb_path, data)
 	results, total_score, max_score, test_results = gradecell.grade_notebook(nb)
+	# Timeouts depend on how busy the machine was, so those results are graded again next run
+	timed_out = isinstance(results, list) and any(res.get('timeout_violations', 0) > 0 for res in results)
+	if not timed_out:
+		try:
+			save_cached_grade(userid, digest, (results, total_score, max_score, test_results))
+		except OSError as e:
+			# The grade is still good; only the next run loses the shortcut
+			print(f"Warning: could not cache grade for user {userid}: {e}")
 	return results, total_score, max_score, test_results
 
+def grade_notebook_for_user_safely(userid, nb_path):
+	"""Runs grade_notebook_for_user, treating any error as an unreadable notebook. Used as the worker task."""
+	try:
+		return grade_notebook_for_user(userid, nb_path)
+	except Exception as e:
+		print(f"Error grading notebook for user {userid}: {e}")
+		return None, None, None, None
+
+# Libraries student notebooks commonly import; each worker loads them once up front if they are installed
+PREWARM_MODULES = ("numpy", "matplotlib", "matplotlib.pyplot")
+
+def buffer_stdout():
+	"""Stops flushing stdout after every line, so per-user status prints do not each cost a write to the terminal.
+	Only for grading in this process; pool workers share the stdout fd, see init_pool_worker."""
+	if hasattr(sys.stdout, "reconfigure"):
+		sys.stdout.reconfigure(line_buffering=False)
+
+def prewarm_worker():
+	"""Imports PREWARM_MODULES so their import cost is not paid inside a graded cell."""
+	for name in PREWARM_MODULES:
+		try:
+			importlib.import_module(name)
+		except ImportError:
+			pass
+
+def init_pool_worker():
+	"""Pool worker initializer: writes stdout a whole line at a time, so lines from workers sharing the fd never mix, then prewarms."""
+	if hasattr(sys.stdout, "reconfigure"):
+		sys.stdout.reconfigure(line_buffering=True)
+	prewarm_worker()
+
+def grade_all_notebooks(userids, nb_paths):
+	"""Grades each user's notebook, in WORKERS parallel processes when WORKERS > 1. Results follow the order of userids."""
+	if WORKERS <= 1:
+		buffer_stdout()
+		prewarm_worker()
+		return [grade_notebook_for_user_safely(userid, nb_path) for userid, nb_path in zip(userids, nb_paths)]
+	# Notebooks are independent and grading is CPU-bound, so each one is graded in a worker process
+	# Send notebooks to workers in batches to cut per-task IPC, keeping a few batches per worker for load balancing
+	chunksize = max(1, len(userids) // (WORKERS * 4))
+	with ProcessPoolExecutor(max_workers=WORKERS, initializer=init_pool_worker) as executor:
+		return list(executor.map(grade_notebook_for_user_safely, userids, nb_paths, chunksize=chunksize))
+
 def write_user_grade_txt(userid, results, total_score, max_score):
+	# FEEDBACK_DIR is created once in main()
 	txt_path = os.path.join(FEEDBACK_DIR, f"{userid}.txt")
-	os.makedirs(FEEDBACK_DIR, exist_ok=True)
+	# Build the whole report first and write it in one call
+	lines = []
+	for res in results:
+		lines.append(f"Cell {res['cell_index']}: {res['passed']}/{res['total']} tests passed, Score: {res['score']:.2f}/{res['pts']}\n")
+		if res['failed_tests']:
+			lines.append("  Failed tests:\n")
+			lines.extend(f"    {fail_msg}\n" for fail_msg in res['failed_tests'])
+		if res.get('safety_violations', 0) > 0:
+			lines.append(f"  Safety violations: {res['safety_violations']}\n")
+		if res.get('timeout_violations', 0) > 0:
+			lines.append(f"  Timeout violations: {res['timeout_violations']}\n")
+	if total_score is None or max_score is None:
+		lines.append("Total Score: Time limit exceeded or error\n")
+	else:
+		lines.append(f"Total Score: {total_score:.2f}/{max_score}\n")
+	lines.append("-- generated by PHYS150grader\n")
 	with open(txt_path, "w", encoding="utf-8") as f:
-		for res in results:
-			f.write(f"Cell {res['cell_index']}: {res['passed']}/{res['total']} tests passed, Score: {res['score']:.2f}/{res['pts']}\n")
-			if res['failed_tests']:
-				f.write("  Failed tests:\n")
-				for fail_msg in res['failed_tests']:
-					f.write(f"    {fail_msg}\n")
-			if res.get('safety_violations', 0) > 0:
-				f.write(f"  Safety violations: {res['safety_violations']}\n")
-			if res.get('timeout_violations', 0) > 0:
-				f.write(f"  Timeout violations: {res['timeout_violations']}\n")
-		if total_score is None or max_score is None:
-			f.write("Total Score: Time limit exceeded or error\n")
-		else:
-			f.write(f"Total Score: {total_score:.2f}/{max_score}\n")
-		f.write("-- generated by PHYS150grader\n")
+		f.write("".join(lines))
 
 def write_user_mismatch_txt(userid, expected, got):
+	# FEEDBACK_DIR is created once in main()
 	txt_path = os.path.join(FEEDBACK_DIR, f"{userid}.txt")
-	os.makedirs(FEEDBACK_DIR, exist_ok=True)
 	with open(txt_path, "w", encoding="utf-8") as f:
-		f.write(f"Cell count mismatch for user {userid}:\n")
-		f.write(f"Expected code cells: {expected}\n")
-		f.write(f"Actual code cells: {got}\n")
+		f.write(f"Cell count mismatch for user {userid}:\nExpected code cells: {expected}\nActual code cells: {got}\n")
 
 def main():
 	userids = sorted(get_userids_from_csv(GRADEBOOK), key=lambda x: int(x) if x.isdigit() else x)
-	summary_scores = defaultdict(list)
+	notebooks = get_submitted_notebooks()
+	# Running sum and count of each problem's pass percentage, for its average in the summary
+	summary_score_sums = defaultdict(float)
+	summary_score_counts = defaultdict(int)
 	safety_violations = defaultdict(int)
 	timeout_violations = defaultdict(int)
 	safety_violation_details = []
@@ -84,69 +236,19 @@ def main():
 	cell_mismatch_users = []
 	wa_lines = []
 	# --- Collect all test keys for header ---
-	import gradecell
+	# Reuse the gradecell loaded above; re-importing it would parse tester.toml again
 	tester = gradecell.tester
 	test_keys = []
 	for prob_idx, problem in enumerate(tester["problem"], 1):
 		for test_idx, _ in enumerate(problem["tests"], 1):
 			test_keys.append(f"prob{prob_idx}_test{test_idx}")
 
-	passfail_rows = []
-	msg_rows = []
 	userids_done = []
-	for userid in userids:
-		try:
-			results, total_score, max_score, test_results = grade_notebook_for_user(userid)
-		except Exception as e:
-			print(f"Error grading notebook for user {userid}: {e}")
-			results, total_score, max_score, test_results = None, None, None, None
-
-		if results == "CELL_MISMATCH":
-			[expected, got] = test_results.values()
-			write_user_mismatch_txt(userid, expected, got)
-			cell_mismatch_users.append(f"User: {userid}, Expected: {expected}, Got: {got}")
-			continue
-		if results is None or test_results is None:
-			unreadable_notebooks.append(userid)
-			continue
-		write_user_grade_txt(userid, results, total_score, max_score)
-		user_grades[userid] = total_score if max_score else 0 if max_score else None
-		user_grades_percentage[userid] = total_score / max_score * 100 if max_score else 0 if max_score else None
-		# Build row for pass/fail and message
-		pf_row = [userid]
-		msg_row = [userid]
-		for key in test_keys:
-			pf_row.append(test_results[key][0])
-			msg_row.append(test_results[key][1])
-		passfail_rows.append(pf_row)
-		msg_rows.append(msg_row)
-		userids_done.append(userid)
-		# --- Existing summary logic ---
-		for i, res in enumerate(results):
-			percent = res['passed'] / res['total'] if res['total'] else 0
-			summary_scores[i].append(percent)
-			safety_violations[i] += res.get('safety_violations', 0)
-			timeout_violations[i] += res.get('timeout_violations', 0)
-			if res.get('safety_violations', 0) > 0:
-				safety_violation_details.append(f"User: {userid}, Cell: {res['cell_index']}")
-			if res.get('timeout_violations', 0) > 0:
-				timeout_violation_details.append(f"User: {userid}, Cell: {res['cell_index']}")
-			for fail_msg in res.get('failed_tests', []):
-				if 'error (' in fail_msg:
-					import re
-					m = re.search(r'error \(([^)]+)\)', fail_msg)
-					err_type = m.group(1) if m else 'UnknownError'
-					exec_err_details.append(f"User: {userid}, Cell: {res['cell_index']}, Error: {err_type}")
-					exec_err_counts[err_type] += 1
-				if 'failed' in fail_msg.lower():
-					wa_lines.append(f"User: {userid}, Cell: {res['cell_index']}, Message: {fail_msg}")
-
-	# Get max_score from gradecell
-	_, _, max_score, _ = gradecell.grade_notebook()
-	
-	# Write pass/fail and message CSVs
-	pf_header = ["ID"] + test_keys
-	msg_header = ["ID"] + test_keys
+	graded = grade_all_notebooks(userids, [notebooks.get(userid) for userid in userids])
+	# Show the buffered status lines once grading is done
+	sys.stdout.flush()
+	os.makedirs(FEEDBACK_DIR, exist_ok=True)
+	# Write pass/fail and message CSVs while going through the users
 	pf_path = os.path.join(SUMMARY_DIR, "test_passfail.csv")
 	msg_path = os.path.join(SUMMARY_DIR, "test_failmsg.csv")
 
@@ -155,111 +257,131 @@ def main():
 	if os.path.exists(msg_path):
 		os.rename(msg_path, os.path.join(SUMMARY_DIR, "test_failmsg_bkup.csv"))
 
-	with open(pf_path, "w", newline='', encoding='utf-8') as f:
-		writer = csv.writer(f)
-		writer.writerow(pf_header)
-		writer.writerows(passfail_rows)
-	with open(msg_path, "w", newline='', encoding='utf-8') as f:
-		writer = csv.writer(f)
-		writer.writerow(msg_header)
-		writer.writerows(msg_rows)
+	with open(pf_path, "w", newline='', encoding='utf-8', buffering=1 << 20) as pf_file, open(msg_path, "w", newline='', encoding='utf-8', buffering=1 << 20) as msg_file:
+		pf_writer = csv.writer(pf_file)
+		msg_writer = csv.writer(msg_file)
+		pf_writer.writerow(["ID"] + test_keys)
+		msg_writer.writerow(["ID"] + test_keys)
+		for userid, (results, total_score, max_score, test_results) in zip(userids, graded):
+			if results == "CELL_MISMATCH":
+				[expected, got] = test_results.values()
+				write_user_mismatch_txt(userid, expected, got)
+				cell_mismatch_users.append(f"User: {userid}, Expected: {expected}, Got: {got}")
+				continue
+			if results is None or test_results is None:
+				unreadable_notebooks.append(userid)
+				continue
+			write_user_grade_txt(userid, results, total_score, max_score)
+			user_grades[userid] = total_score if max_score else 0 if max_score else None
+			user_grades_percentage[userid] = total_score / max_score * 100 if max_score else 0 if max_score else None
+			# Write this user's pass/fail and message rows right away
+			user_tests = [test_results[key] for key in test_keys]
+			pf_writer.writerow([userid] + [t[0] for t in user_tests])
+			msg_writer.writerow([userid] + [t[1] for t in user_tests])
+			userids_done.append(userid)
+			# --- Existing summary logic ---
+			for i, res in enumerate(results):
+				percent = res['passed'] / res['total'] if res['total'] else 0
+				summary_score_sums[i] += percent
+				summary_score_counts[i] += 1
+				safety_violations[i] += res.get('safety_violations', 0)
+				timeout_violations[i] += res.get('timeout_violations', 0)
+				if res.get('safety_violations', 0) > 0:
+					safety_violation_details.append(f"User: {userid}, Cell: {res['cell_index']}")
+				if res.get('timeout_violations', 0) > 0:
+					timeout_violation_details.append(f"User: {userid}, Cell: {res['cell_index']}")
+				for fail_msg in res.get('failed_tests', []):
+					m = _ERR_TYPE_RE.search(fail_msg)
+					if m:
+						err_type = m.group(1) or 'UnknownError'
+						exec_err_details.append(f"User: {userid}, Cell: {res['cell_index']}, Error: {err_type}")
+						exec_err_counts[err_type] += 1
+					if 'failed' in fail_msg.lower():
+						wa_lines.append(f"User: {userid}, Cell: {res['cell_index']}, Message: {fail_msg}")
+
+	# Get max_score from gradecell, computed once from tester.toml
+	max_score = gradecell.MAX_SCORE
 
 	# Write all assertion errors to wa.txt
 	if wa_lines:
 		wa_path = os.path.join(SUMMARY_DIR, "wa.txt")
 		with open(wa_path, "w", encoding="utf-8") as waf:
-			for line in wa_lines:
-				waf.write(line + "\n")
+			waf.write("".join(line + "\n" for line in wa_lines))
 
 	# Write summary metadata
 	meta_path = os.path.join(SUMMARY_DIR, "grading_summary.txt")
+	# Build the whole summary first and write it in one call
+	lines = ["Problem Index,Avg Percentage,Safety Violations,Timeout Violations\n"]
+	for i in sorted(summary_score_counts.keys()):
+		avg_pct = summary_score_sums[i] / summary_score_counts[i]
+		lines.append(f"{i},{avg_pct:.2%},{safety_violations[i]},{timeout_violations[i]}\n")
+	# --- Calculate and write average total score ---
+	valid_scores = [score for score in user_grades.values() if score is not None]
+	if valid_scores:
+		avg_total_score = sum(valid_scores) / len(valid_scores)
+		# Assuming max_score is consistent across all users, get it from the last valid run
+		if max_score is not None:
+			lines.append(f"\nAverage Total Score: {avg_total_score:.2f}/{max_score}\n")
+	# -----------------------------------------
+	if safety_violation_details:
+		lines.append("\nSafety Violations (User, Cell):\n")
+		lines.extend(f"{detail}\n" for detail in safety_violation_details)
+	if timeout_violation_details:
+		lines.append("\nTimeout Violations (User, Cell):\n")
+		lines.extend(f"{detail}\n" for detail in timeout_violation_details)
+	if exec_err_details:
+		lines.append("\nExecution Errors (User, Cell, Error Type):\n")
+		lines.extend(f"{detail}\n" for detail in exec_err_details)
+		lines.append("\nExecution Error Counts by Type:\n")
+		lines.extend(f"{err_type}: {count}\n" for err_type, count in exec_err_counts.items())
+	if unreadable_notebooks:
+		lines.append("\nUnreadable Notebooks (User IDs):\n")
+		lines.extend(f"{uid}\n" for uid in unreadable_notebooks)
+	if cell_mismatch_users:
+		lines.append("\nCell Count Mismatch (User, Expected, Got):\n")
+		lines.extend(f"{detail}\n" for detail in cell_mismatch_users)
 	with open(meta_path, "w", encoding="utf-8") as f:
-		f.write("Problem Index,Avg Percentage,Safety Violations,Timeout Violations\n")
-		for i in sorted(summary_scores.keys()):
-			avg_pct = sum(summary_scores[i]) / len(summary_scores[i]) if summary_scores[i] else 0
-			f.write(f"{i},{avg_pct:.2%},{safety_violations[i]},{timeout_violations[i]}\n")
-		# --- Calculate and write average total score ---
-		valid_scores = [score for score in user_grades.values() if score is not None]
-		if valid_scores:
-			avg_total_score = sum(valid_scores) / len(valid_scores)
-			# Assuming max_score is consistent across all users, get it from the last valid run
-			if max_score is not None:
-				f.write(f"\nAverage Total Score: {avg_total_score:.2f}/{max_score}\n")
-		# -----------------------------------------
-		if safety_violation_details:
-			f.write("\nSafety Violations (User, Cell):\n")
-			for detail in safety_violation_details:
-				f.write(f"{detail}\n")
-		if timeout_violation_details:
-			f.write("\nTimeout Violations (User, Cell):\n")
-			for detail in timeout_violation_details:
-				f.write(f"{detail}\n")
-		if exec_err_details:
-			f.write("\nExecution Errors (User, Cell, Error Type):\n")
-			for detail in exec_err_details:
-				f.write(f"{detail}\n")
-			f.write("\nExecution Error Counts by Type:\n")
-			for err_type, count in exec_err_counts.items():
-				f.write(f"{err_type}: {count}\n")
-		if unreadable_notebooks:
-			f.write("\nUnreadable Notebooks (User IDs):\n")
-			for uid in unreadable_notebooks:
-				f.write(f"{uid}\n")
-		if cell_mismatch_users:
-			f.write("\nCell Count Mismatch (User, Expected, Got):\n")
-			for detail in cell_mismatch_users:
-				f.write(f"{detail}\n")
+		f.write("".join(lines))
 
 	# Add grade column to gradebook with config.toml homework_title
 	homework_title = config.get("homework_title", "New Assignment")
-	with open(GRADEBOOK, newline='', encoding='utf-8') as f:
-		rows = list(csv.reader(f))
-	header = rows[0]
-	# Find points possible row (usually 2nd row)
-	points_row_idx = None
-	for idx, row in enumerate(rows):
-		if any("Points Possible" in cell for cell in row):
-			points_row_idx = idx
-			break
-	# Find column index matching homework_title prefix
-	col_idx = None
-	for i, col in enumerate(header):
-		if col.startswith(homework_title):
-			col_idx = i
-			break
-	if col_idx is None:
-		# No matching column, append new
-		header.append(homework_title)
-		col_idx = len(header) - 1
-		if points_row_idx is not None:
-			rows[points_row_idx].append(str(max_score))
-		for r in rows[1:]:
-			r.append("")
-	for row in rows[1:]:
-		if len(row) < len(header):
-			row += [""] * (len(header) - len(row))
-		id_val = row[header.index("ID")].strip() if "ID" in header else ""
-		if id_val in user_grades:
-			row[col_idx] = f"{user_grades[id_val]:.2f}"
-	# Find their indices in the header row
-	ID_indices = [header.index(h) for h in HEADERS]
-	grade_col_idx = col_idx
-	# Avoid duplicate if grade_col_idx is within first 4
-	output_indices = ID_indices.copy()
-	if grade_col_idx not in output_indices:
-		output_indices.append(grade_col_idx)
-	# Prepare filtered rows
-	filtered_rows = []
-	for row in [header] + rows[1:]:
-		# Pad row if needed
-		if len(row) < len(header):
-			row += [""] * (len(header) - len(row))
-		filtered_rows.append([row[i] for i in output_indices])
-	# Define output path before writing
+	# Stream the gradebook row by row into grade_updated.csv instead of holding every row in memory
 	out_path = os.path.join(os.path.dirname(__file__), "grade_updated.csv")
-	with open(out_path, "w", newline='', encoding='utf-8') as f:
-		writer = csv.writer(f)
-		writer.writerows(filtered_rows)
+	with open(GRADEBOOK, newline='', encoding='utf-8') as f:
+		reader = csv.reader(f)
+		header = next(reader)
+		# Find points possible row (usually 2nd row); only the first one gets the max score of a new column
+		points_row_found = any("Points Possible" in cell for cell in header)
+		# Find column index matching homework_title prefix
+		col_idx = next((i for i, col in enumerate(header) if col.startswith(homework_title)), None)
+		new_col = col_idx is None
+		if new_col:
+			# No matching column, append new
+			header.append(homework_title)
+			col_idx = len(header) - 1
+		id_idx = header.index("ID") if "ID" in header else None
+		# Find their indices in the header row
+		ID_indices = [header.index(h) for h in HEADERS]
+		# Avoid duplicate if col_idx is within first 4
+		output_indices = ID_indices.copy()
+		if col_idx not in output_indices:
+			output_indices.append(col_idx)
+		# Picks the output columns of a row in C; always returns a tuple, as there are at least the 4 ID columns
+		project = itemgetter(*output_indices)
+		with open(out_path, "w", newline='', encoding='utf-8') as out:
+			writer = csv.writer(out)
+			writer.writerow(project(header))
+			for row in reader:
+				# Pad row if needed
+				if len(row) < len(header):
+					row += [""] * (len(header) - len(row))
+				if new_col and not points_row_found and any("Points Possible" in cell for cell in row):
+					points_row_found = True
+					row[col_idx] = str(max_score)
+				id_val = row[id_idx].strip() if id_idx is not None else ""
+				if id_val in user_grades:
+					row[col_idx] = f"{user_grades[id_val]:.2f}"
+				writer.writerow(project(row))
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -1,20 +1,20 @@
 import csv
 import os
-import toml
+from configloader import load_toml
 
 HEADERS = ["Student", "ID", "SIS Login ID", "Section"]
 
 def main():
 
     # Read config and tester
-    config = toml.load(os.path.join(os.path.dirname(__file__), "config.toml"))
+    config = load_toml(os.path.join(os.path.dirname(__file__), "config.toml"))
     HOMEWORK_DIR = config.get("homework_dir", None)
     FEEDBACK_DIR = os.path.join(HOMEWORK_DIR, config.get("feedback_dir", "feedback"))
     GRADEBOOK = os.path.join(os.path.dirname(__file__), "grade_updated.csv")
 
     os.makedirs(FEEDBACK_DIR, exist_ok=True)
     tester_path = os.path.join(HOMEWORK_DIR, "tester.toml")
-    tester = toml.load(tester_path)
+    tester = load_toml(tester_path)
 
     # Read passfail and failmsg CSVs
     pf_path = os.path.join(HOMEWORK_DIR, "test_passfail.csv")
@@ -71,76 +71,49 @@ def main():
 
     # Add grade column to gradebook with config.toml homework_title
     homework_title = config.get("homework_title", "New Assignment")
+    # Stream the gradebook row by row instead of holding every row in memory
+    updated_gradebook_path = os.path.join(os.path.dirname(__file__), "grade_updated.csv")
+    # GRADEBOOK is the same file as the output, so write a temporary file and move it into place afterwards
+    tmp_path = updated_gradebook_path + ".tmp"
     with open(GRADEBOOK, newline='', encoding='utf-8') as f:
-        rows = list(csv.reader(f))
-    header = rows[0]
-    # Find points possible row (usually 2nd row)
-    points_row_idx = None
-    for idx, row in enumerate(rows):
-        if any("Points Possible" in cell for cell in row):
-            points_row_idx = idx
-            break
-    # Find column index matching homework_title prefix
-    col_idx = None
-    for i, col in enumerate(header):
-        if col.startswith(homework_title):
-            col_idx = i
-            break
-    if col_idx is None:
-        # No matching column, append new
-        header.append(homework_title)
-        col_idx = len(header) - 1
-        if points_row_idx is not None:
-            # Ensure points possible row has enough columns
-            while len(rows[points_row_idx]) < len(header):
-                rows[points_row_idx].append("")
-            rows[points_row_idx][col_idx] = str(max_score)
-        # For other rows, we'll handle length when updating
-    
-    # Update grades
-    for row in rows[1:]:
-        if row and len(row) > header.index("ID"):
-            id_val = row[header.index("ID")].strip()
-            if id_val in user_grades:
-                # Ensure row has enough columns
-                while len(row) < len(header):
-                    row.append("")
-                row[col_idx] = f"{user_grades[id_val]:.2f}"
+        reader = csv.reader(f)
+        header = next(reader)
+        # Find points possible row (usually 2nd row); only the first one gets the max score of a new column
+        points_row_found = any("Points Possible" in cell for cell in header)
+        # Find column index matching homework_title prefix
+        col_idx = next((i for i, col in enumerate(header) if col.startswith(homework_title)), None)
+        new_col = col_idx is None
+        if new_col:
+            # No matching column, append new
+            header.append(homework_title)
+            col_idx = len(header) - 1
+        id_idx = header.index("ID")
 
-    # Write updated grades to a new CSV file, keeping only essential columns
-    updated_gradebook_path = os.path.join(os.path.dirname(__file__), "grade_updated.csv")
-    
-    # Determine indices of columns to keep
-    indices_to_keep = []
-    for h in HEADERS:
-        if h in header:
-            indices_to_keep.append(header.index(h))
-    # Add the current assignment column index
-    if col_idx is not None:
+        # Determine indices of columns to keep, plus the current assignment column
+        indices_to_keep = [header.index(h) for h in HEADERS if h in header]
         indices_to_keep.append(col_idx)
 
-    # Create new list of rows with only the desired columns
-    new_rows = []
-    new_header_row = [header[i] for i in indices_to_keep]
-    
-    # Adjust homework title if it was a new column
-    if homework_title not in new_header_row:
-        new_header_row[-1] = homework_title
-
-    new_rows.append(new_header_row)
-
-    for row in rows[1:]:
-        new_row = []
-        for i in indices_to_keep:
-            if i < len(row):
-                new_row.append(row[i])
-            else:
-                new_row.append("")
-        new_rows.append(new_row)
+        new_header_row = [header[i] for i in indices_to_keep]
+        # Adjust homework title if it was a new column
+        if homework_title not in new_header_row:
+            new_header_row[-1] = homework_title
 
-    with open(updated_gradebook_path, "w", newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(new_rows)
+        # Write updated grades to a new CSV file, keeping only essential columns
+        with open(tmp_path, "w", newline='', encoding='utf-8') as out:
+            writer = csv.writer(out)
+            writer.writerow(new_header_row)
+            for row in reader:
+                # Pad row if needed
+                if len(row) < len(header):
+                    row += [""] * (len(header) - len(row))
+                if new_col and not points_row_found and any("Points Possible" in cell for cell in row):
+                    points_row_found = True
+                    row[col_idx] = str(max_score)
+                id_val = row[id_idx].strip()
+                if id_val in user_grades:
+                    row[col_idx] = f"{user_grades[id_val]:.2f}"
+                writer.writerow([row[i] for i in indices_to_keep])
+    os.replace(tmp_path, updated_gradebook_path)
     print(f"Grades updated and saved to {updated_gradebook_path}")
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
 import zipfile
 import os
-import toml
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from configloader import load_toml
 
 # Read config
-config = toml.load(os.path.join(os.path.dirname(__file__), "config.toml"))
+config = load_toml(os.path.join(os.path.dirname(__file__), "config.toml"))
 homework_dir = config.get("homework_dir", "hw0")
 submissions_dir = config.get("submissions_dir", "submissions")
 
@@ -11,17 +13,30 @@ zip_path = os.path.join(homework_dir, "submissions.zip")
 output_dir = os.path.join(homework_dir, submissions_dir)
 os.makedirs(output_dir, exist_ok=True)
 
+def extract_user_id(name):
+    """Returns the user_id between the 2nd and 3rd underscore, or the 3rd and 4th for LATE submissions."""
+    # Only the first few fields matter, so stop splitting there
+    parts = name.split('_', 3)
+    return parts[2] if parts[1] == "LATE" else parts[1]
+
+# Map each output file to its member; if a user has several members, the last one in the zip wins as before
+targets = {}
 with zipfile.ZipFile(zip_path, 'r') as zipf:
     for name in zipf.namelist():
         if name.endswith('.ipynb'):
-            # Extract user_id between 2nd and 3rd underscore
-            parts = name.split('_')
-            user_id = ""
-            if parts[1] == "LATE":
-                user_id = parts[2]
-            else:
-                user_id = parts[1]
-            new_name = f"{user_id}.ipynb"
-            data = zipf.read(name)
-            with open(os.path.join(output_dir, new_name), 'wb') as f:
-                f.write(data)
+            targets[f"{extract_user_id(name)}.ipynb"] = name
+
+def extract_notebooks(jobs):
+    """Extracts (new_name, member) pairs; each thread opens its own ZipFile, as one is not safe to share."""
+    with zipfile.ZipFile(zip_path, 'r') as zipf:
+        for new_name, name in jobs:
+            # Stream the member to disk in 1 MiB chunks instead of reading it into memory first
+            with zipf.open(name) as src, open(os.path.join(output_dir, new_name), 'wb') as f:
+                shutil.copyfileobj(src, f, length=1 << 20)
+
+# zlib releases the GIL while decompressing, so members can be extracted by several threads at once
+jobs = list(targets.items())
+workers = max(1, min(8, os.cpu_count() or 1, len(jobs)))
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    # list() re-raises any extraction error
+    list(executor.map(extract_notebooks, [jobs[i::workers] for i in range(workers)]))
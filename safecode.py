@@ -1,17 +1,33 @@
 import sys
+import io
+import re
+import ast
+import builtins
 from types import SimpleNamespace
+from collections import namedtuple
+from contextlib import redirect_stdout
+from enum import IntEnum
+from functools import lru_cache
 import multiprocessing
-import toml
+from configloader import load_toml
 
 # Read timeout from config.toml
 import os
 config_path = os.path.join(os.path.dirname(__file__), "config.toml")
-if os.path.exists(config_path):
-    config = toml.load(config_path)
+try:
+    config = load_toml(config_path)
     TIMEOUT = config.get("timeout", 3)
-else:
+except FileNotFoundError:
     TIMEOUT = 3
 
+class CellStatus(IntEnum):
+    OK = 0
+    TIMEOUT = 1
+    ERROR = 2
+
+# What run_cell reports back: status, captured stdout, and the exception for ERROR (else None)
+CellResult = namedtuple("CellResult", "status stdout exc")
+
 # previous code that used multiprocessing for timeout. Now disabled due to PicklingError when student code contains function, class, etc.
 # def _exec_code(cell_code, ns_dict, queue):
 #     try:
@@ -44,31 +60,147 @@ else:
 #     if isinstance(result, dict):
 #         test_ns.__dict__.update(result)
 
+@lru_cache(maxsize=4096)
+def compile_cell(cell_code):
+    """Compiles a cell source once; reused across tests and students with the same code."""
+    # Same filename exec() uses for strings, so SyntaxError messages are unchanged
+    return compile(cell_code, "<string>", "exec")
+
+# Reused by every run_cell call to capture the cell's stdout
+_stdout_buf = io.StringIO()
+
+# cell_code may be a source string (compiled through compile_cell) or a code object
 def run_cell(cell_code, test_ns):
+    _stdout_buf.seek(0)
+    _stdout_buf.truncate()
     try:
-        exec(cell_code, test_ns.__dict__)
+        if isinstance(cell_code, str):
+            cell_code = compile_cell(cell_code)
+        with redirect_stdout(_stdout_buf):
+            exec(cell_code, test_ns)
     except Exception as e:
-        raise e
-    return None
+        return CellResult(CellStatus.ERROR, _stdout_buf.getvalue(), e)
+    return CellResult(CellStatus.OK, _stdout_buf.getvalue(), None)
 
-def is_code_safe(cell_code):
-    banned_imports = ["os", "sys", "subprocess", "socket", "shutil", "pathlib", "requests", "multiprocessing", "threading", "ctypes", "pickle"]
-    # The most disruptive calls (input, exit, quit) are now handled by sanitize_student_code
-    banned_patterns = ["open(", "eval(", "exec(", "__import__", "compile(", "globals(", "locals(", "setattr(", "delattr(", "getattr(", "system(", "fork(", "kill(", "remove(", "rmdir(", "unlink(", "chmod(", "chown(", "popen(", "walk(", "makedirs(", "mkdir(", "rmtree(", "copy(", "move(", "rename(", "socket.", "threading.", "multiprocessing."]
-    for imp in banned_imports:
+BANNED_IMPORTS = ["os", "sys", "subprocess", "socket", "shutil", "pathlib", "requests", "multiprocessing", "threading", "ctypes", "pickle", "builtins"]
+# The most disruptive calls (input, exit, quit) are now handled by sanitize_student_code
+BANNED_PATTERNS = ["open(", "eval(", "exec(", "__import__", "compile(", "globals(", "locals(", "setattr(", "delattr(", "getattr(", "system(", "fork(", "kill(", "remove(", "rmdir(", "unlink(", "chmod(", "chown(", "popen(", "walk(", "makedirs(", "mkdir(", "rmtree(", "copy(", "move(", "rename(", "socket.", "threading.", "multiprocessing."]
+# Ways to reach the real builtins (and from there __import__) without naming a banned function
+BANNED_DUNDERS = ["__builtins__", "__globals__"]
+# Matches if any of the checks in is_code_safe would fire, so safe code is scanned once instead of once per pattern
+_banned_imports_alt = "|".join(map(re.escape, BANNED_IMPORTS))
+_BANNED_RE = re.compile(
+    rf"import (?:{_banned_imports_alt})|from (?:{_banned_imports_alt}) import|" + "|".join(map(re.escape, BANNED_PATTERNS + BANNED_DUNDERS))
+)
+
+# Names behind the "name(" and "module." patterns, for checking a parsed cell
+_BANNED_CALLS = {pat[:-1] for pat in BANNED_PATTERNS if pat.endswith("(")}
+_BANNED_MODULE_ATTRS = {pat[:-1] for pat in BANNED_PATTERNS if pat.endswith(".")}
+# Banned builtins are blocked wherever they are referenced, since e = exec; e(...) calls them under another name
+_BANNED_BUILTIN_REFS = {name for name in _BANNED_CALLS if hasattr(builtins, name)}
+# Calls that import the module named by their first argument
+_IMPORT_CALLS = {"__import__", "import_module"}
+# Any banned name the parsed check can find must appear as a word in plain ASCII source
+_BANNED_NAME_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, sorted(set(BANNED_IMPORTS) | _BANNED_CALLS | _BANNED_MODULE_ATTRS | set(BANNED_DUNDERS) | {"__import__"}))) + r")\b")
+
+class _BannedCodeFinder(ast.NodeVisitor):
+    """Collects the banned imports and patterns actually used by a parsed cell.
+    Strings and comments are ignored, except for dunder names used to look up builtins and modules passed to import calls."""
+    def __init__(self):
+        self.imports = set()
+        self.patterns = set()
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.add(alias.name.split(".")[0])
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        if node.module:
+            self.imports.add(node.module.split(".")[0])
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+        if name in _BANNED_CALLS:
+            self.patterns.add(name + "(")
+        # e.g. importlib.import_module('os')
+        if name in _IMPORT_CALLS and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+            self.imports.add(node.args[0].value.split(".")[0])
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id in _BANNED_MODULE_ATTRS:
+            self.patterns.add(node.value.id + ".")
+        if node.attr == "__import__":
+            self.patterns.add("__import__")
+        if node.attr in BANNED_DUNDERS:
+            self.patterns.add(node.attr)
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id == "__import__":
+            self.patterns.add("__import__")
+        if node.id in BANNED_DUNDERS:
+            self.patterns.add(node.id)
+        # vars(builtins)['exec'] and the like reach every builtin through the module
+        if node.id == "builtins":
+            self.imports.add("builtins")
+        if node.id in _BANNED_BUILTIN_REFS and isinstance(node.ctx, ast.Load):
+            self.patterns.add(node.id + "(")
+
+    def visit_Constant(self, node):
+        # e.g. __builtins__['__import__']('subprocess')
+        if isinstance(node.value, str) and (node.value == "__import__" or node.value in BANNED_DUNDERS):
+            self.patterns.add(node.value)
+
+def _is_code_safe_text(cell_code):
+    """Substring version of is_code_safe, used when the cell does not parse."""
+    if not _BANNED_RE.search(cell_code):
+        return True, ""
+    # Something is banned: report it in list order
+    for imp in BANNED_IMPORTS:
         if f"import {imp}" in cell_code or f"from {imp} import" in cell_code:
             return False, f"Banned import detected: {imp}"
-    for pat in banned_patterns:
+    for pat in BANNED_PATTERNS + BANNED_DUNDERS:
         if pat in cell_code:
             return False, f"Banned code pattern detected: {pat}"
     return True, ""
 
+# The checks below are pure functions of the code string; many students submit identical cells (e.g. starter code), so cache them
+@lru_cache(maxsize=4096)
+def is_code_safe(cell_code):
+    # Skip parsing when no banned name appears anywhere, since the parsed check could not find anything either
+    # (non-ASCII identifiers are NFKC-normalized by the parser, so those cells are always parsed)
+    if cell_code.isascii() and not _BANNED_NAME_RE.search(cell_code):
+        return True, ""
+    try:
+        tree = ast.parse(cell_code)
+    except (SyntaxError, ValueError, RecursionError):
+        return _is_code_safe_text(cell_code)
+    finder = _BannedCodeFinder()
+    finder.visit(tree)
+    # __import__ stays banned anywhere in the source, as with the substring checks, since it can be built up in ways the tree does not show
+    if "__import__" in cell_code:
+        finder.patterns.add("__import__")
+    # Report in list order, as the substring checks did
+    for imp in BANNED_IMPORTS:
+        if imp in finder.imports:
+            return False, f"Banned import detected: {imp}"
+    for pat in BANNED_PATTERNS + BANNED_DUNDERS:
+        if pat in finder.patterns:
+            return False, f"Banned code pattern detected: {pat}"
+    return True, ""
+
+@lru_cache(maxsize=4096)
 def remove_input_lines(code_string):
     """Removes lines containing input() calls from a code string."""
     lines = code_string.splitlines()
     filtered_lines = [line for line in lines if "input(" not in line]
     return "\n".join(filtered_lines)
 
+@lru_cache(maxsize=4096)
 def sanitize_student_code(code_string):
     """Removes lines containing potentially disruptive functions like input(), quit(), or exit() from a code string."""
     lines = code_string.splitlines()
@@ -1,14 +1,17 @@
 import sys
+import io
 from types import SimpleNamespace
+from contextlib import redirect_stdout
 import signal
-import toml
 import os
+from configloader import load_toml
+from safecode import CellResult, CellStatus, compile_cell
 
 config_path = os.path.join(os.path.dirname(__file__), "config.toml")
-if os.path.exists(config_path):
-    config = toml.load(config_path)
+try:
+    config = load_toml(config_path)
     TIMEOUT = config.get("timeout", 3)
-else:
+except FileNotFoundError:
     TIMEOUT = 3
 
 class TimeoutException(Exception):
@@ -17,15 +20,27 @@ class TimeoutException(Exception):
 def timeout_handler(signum, frame):
     raise TimeoutException("Code execution timed out")
 
-# Use signal for timeout (Unix only)
+# Reused by every run_cell call to capture the cell's stdout
+_stdout_buf = io.StringIO()
+
+# Use signal for timeout (Unix only); cell_code may be a source string (compiled through compile_cell) or a code object
 def run_cell(cell_code, test_ns):
+    _stdout_buf.seek(0)
+    _stdout_buf.truncate()
+    try:
+        if isinstance(cell_code, str):
+            cell_code = compile_cell(cell_code)
+    except Exception as e:
+        return CellResult(CellStatus.ERROR, "", e)
     signal.signal(signal.SIGALRM, timeout_handler)
     signal.alarm(TIMEOUT)
     try:
-        exec(cell_code, test_ns.__dict__)
+        with redirect_stdout(_stdout_buf):
+            exec(cell_code, test_ns)
     except TimeoutException:
-        return "__DEADLOOP__"
+        return CellResult(CellStatus.TIMEOUT, _stdout_buf.getvalue(), None)
     except Exception as e:
-        raise e
+        return CellResult(CellStatus.ERROR, _stdout_buf.getvalue(), e)
     finally:
         signal.alarm(0)
+    return CellResult(CellStatus.OK, _stdout_buf.getvalue(), None)
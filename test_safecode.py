@@ -0,0 +1,34 @@
+import pytest
+from safecode import is_code_safe
+
+# Indirect routes to banned builtins and modules; each of these must be rejected
+UNSAFE_CELLS = [
+    "e = exec; e('import os; os.system(\"id\")')",
+    "vars(builtins)['exec']('import os')",
+    "builtins.__dict__['exec']('import subprocess')",
+    "x = [exec][0]; x('from shutil import rmtree')",
+    "g = getattr; g(builtins, 'ex'+'ec')('import os')",
+    "__builtins__['__import__']('subprocess').check_output(['id'])",
+    "__builtins__.__dict__['__import__']('shutil')",
+    "(lambda: 0).__globals__['__builtins__']['__import__']('os')",
+    "import importlib\nimportlib.import_module('os')",
+    "import builtins",
+]
+
+# Strings that merely mention banned names are fine
+SAFE_CELLS = [
+    "print('sys')",
+    "label = \"os\"",
+    "s = 'call open( in a string'\nprint(s)",
+    "import math\nprint(math.sqrt(2))",
+    "copy = 3\nprint(copy)",
+]
+
+@pytest.mark.parametrize("cell_code", UNSAFE_CELLS)
+def test_unsafe_cells_are_rejected(cell_code):
+    safe, msg = is_code_safe(cell_code)
+    assert not safe and msg
+
+@pytest.mark.parametrize("cell_code", SAFE_CELLS)
+def test_safe_cells_pass(cell_code):
+    assert is_code_safe(cell_code) == (True, "")